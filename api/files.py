@@ -3,60 +3,181 @@ REST API for database file operations
 20250602_101700_0_0_1_5
 """
 
-from flask import Flask, request, jsonify, Blueprint
+from flask import Flask, request, jsonify, Blueprint, Response, stream_with_context, current_app
+from werkzeug.exceptions import HTTPException
+import orjson
+import numpy as np
+import hashlib
 import sqlite3
 import os
 import logging
+import threading
 import time
 from functools import wraps
-from ..database.operations import V3Database
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 files_api = Blueprint('files_api', __name__)
-db = V3Database()
-
-def handle_errors(f):
-    """Decorator for comprehensive error handling"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        try:
-            return f(*args, **kwargs)
-        except ValueError as e:
-            logger.error(f"Validation error in {f.__name__}: {str(e)}")
-            return jsonify({
-                'status': 'error',
-                'errorType': 'validation_error',
-                'message': str(e),
-                'timestamp': time.time()
-            }), 400
-        except sqlite3.Error as e:
-            logger.error(f"Database error in {f.__name__}: {str(e)}")
-            return jsonify({
-                'status': 'error',
-                'errorType': 'database_error',
-                'message': 'Database operation failed',
-                'timestamp': time.time()
-            }), 500
-        except FileNotFoundError as e:
-            logger.error(f"File not found in {f.__name__}: {str(e)}")
-            return jsonify({
-                'status': 'error',
-                'errorType': 'file_not_found',
-                'message': 'Requested file not found',
-                'timestamp': time.time()
-            }), 404
-        except Exception as e:
-            logger.error(f"Unexpected error in {f.__name__}: {str(e)}")
-            return jsonify({
-                'status': 'error',
-                'errorType': 'internal_error',
-                'message': 'Internal server error',
-                'timestamp': time.time()
-            }), 500
-    return decorated_function
+
+def get_db():
+    """Get the V3Database instance attached to the current app"""
+    return current_app.extensions['database']
+
+# Response key tuples matching the column order returned by the DB layer -
+# dict(zip(...)) is much cheaper per row than building dicts field-by-field
+FILE_KEYS = ('fileId', 'filename', 'path', 'label',
+             'transient1Index', 'transient2Index', 'transient3Index',
+             'voltageLevel', 'currentLevel', 'binaryPath')
+FILE_DETAIL_KEYS = FILE_KEYS + ('totalSamples', 'samplingRate')
+
+# Hoisted label allowlist: O(1) membership and a precomputed error message
+VALID_LABELS = frozenset({'arc', 'weak_arc', 'restriking_arc', 'parallel_motor_arc',
+                          'negative_transient', 'steady_state', 'other'})
+VALID_LABELS_MSG = 'Invalid label filter. Must be one of: ' + ', '.join(sorted(VALID_LABELS))
+
+def fast_json(obj, status=200):
+    """Serialize a response with orjson (handles numpy arrays natively)"""
+    return Response(
+        orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY),
+        status=status,
+        mimetype='application/json'
+    )
+
+def _etag_matches(etag):
+    """Check the request's If-None-Match header against our body hash
+
+    flask-compress rewrites the ETag of compressed responses to
+    "<hash>:<algorithm>" and clients echo that form back, so strip quotes,
+    weak markers and the compression suffix before comparing.
+    """
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        candidate = candidate.strip('"')
+        if candidate.split(':', 1)[0] == etag:
+            return True
+    return False
+
+def etag_json(obj):
+    """Serialize with orjson, answering unchanged polls with 304 Not Modified
+
+    The ETag is a hash of the response body, so polling clients that send
+    If-None-Match skip the transfer entirely whenever the data is unchanged.
+    """
+    body = orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+    if _etag_matches(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    # Quoted per RFC 9110; flask-compress splices its suffix inside the
+    # quotes of compressed responses, which _etag_matches accounts for
+    response.headers['ETag'] = f'"{etag}"'
+    return response
+
+# Precompiled error bodies - fixed messages are encoded once at import time
+# instead of paying dict build + JSON encode on every error response
+ERR_DATA_NOT_FOUND = orjson.dumps({'status': 'error', 'message': 'File data not found'})
+ERR_MISSING_LABEL = orjson.dumps({'status': 'error', 'message': 'Missing label in request'})
+ERR_MISSING_DATA = orjson.dumps({'status': 'error', 'message': 'Missing request data'})
+
+def error_response(body, status):
+    """Build a Response from a precompiled error body"""
+    return Response(body, status=status, mimetype='application/json')
+
+# Centralized error handlers - routes stay straight-line and raise; the
+# handlers below produce the uniform error envelope for the whole app
+@files_api.app_errorhandler(ValueError)
+def handle_validation_error(e):
+    logger.error(f"Validation error: {str(e)}")
+    return fast_json({
+        'status': 'error',
+        'errorType': 'validation_error',
+        'message': str(e),
+        'timestamp': time.time()
+    }, status=400)
+
+@files_api.app_errorhandler(sqlite3.Error)
+def handle_database_error(e):
+    logger.error(f"Database error: {str(e)}")
+    return fast_json({
+        'status': 'error',
+        'errorType': 'database_error',
+        'message': 'Database operation failed',
+        'timestamp': time.time()
+    }, status=500)
+
+@files_api.app_errorhandler(FileNotFoundError)
+def handle_file_not_found(e):
+    logger.error(f"File not found: {str(e)}")
+    return fast_json({
+        'status': 'error',
+        'errorType': 'file_not_found',
+        'message': 'Requested file not found',
+        'timestamp': time.time()
+    }, status=404)
+
+@files_api.app_errorhandler(Exception)
+def handle_unexpected_error(e):
+    if isinstance(e, HTTPException):
+        return e
+    logger.error(f"Unexpected error: {str(e)}")
+    return fast_json({
+        'status': 'error',
+        'errorType': 'internal_error',
+        'message': 'Internal server error',
+        'timestamp': time.time()
+    }, status=500)
+
+# TTL cache for slow-changing aggregates - invalidated by bumping the version
+_cache_lock = threading.Lock()
+_cache_version = 0
+
+def bump_cache_version():
+    """Invalidate all TTL-cached results after a write"""
+    global _cache_version
+    with _cache_lock:
+        _cache_version += 1
+
+def ttl_cache(seconds, max_entries=64):
+    """Decorator caching results for a short TTL, keyed by args + cache version"""
+    def decorator(f):
+        cache = {}
+
+        @wraps(f)
+        def wrapper(*args):
+            key = (args, _cache_version)
+            now = time.monotonic()
+            with _cache_lock:
+                entry = cache.get(key)
+                if entry is not None and now - entry[0] < seconds:
+                    return entry[1]
+            value = f(*args)
+            with _cache_lock:
+                if len(cache) >= max_entries:
+                    cache.clear()
+                cache[key] = (now, value)
+            return value
+        return wrapper
+    return decorator
+
+@ttl_cache(30)
+def _cached_status_summary():
+    return get_db().get_status_summary()
+
+@ttl_cache(30)
+def _cached_label_statistics():
+    return get_db().get_label_statistics()
+
+@ttl_cache(5)
+def _cached_all_files(label_filter, after_id, limit):
+    return get_db().get_all_files(label_filter=label_filter, after_id=after_id, limit=limit)
 
 def validate_file_id(file_id):
     """Validate file ID parameter"""
@@ -68,215 +189,261 @@ def validate_json_request(required_fields=None):
     """Validate JSON request data"""
     if not request.is_json:
         raise ValueError("Request must be JSON")
-    
+
     data = request.get_json()
     if not data:
         raise ValueError("Request body cannot be empty")
-    
+
     if required_fields:
         missing_fields = [field for field in required_fields if field not in data]
         if missing_fields:
             raise ValueError(f"Missing required fields: {', '.join(missing_fields)}")
-    
+
     return data
 
 @files_api.route('/api/files', methods=['GET'])
-@handle_errors
 def get_files():
     """Get list of files from database"""
     label_filter = request.args.get('label')
-    if label_filter:
-        # Validate label filter
-        valid_labels = ['arc', 'weak_arc', 'restriking_arc', 'parallel_motor_arc', 
-                       'negative_transient', 'steady_state', 'other']
-        if label_filter not in valid_labels:
-            raise ValueError(f"Invalid label filter. Must be one of: {', '.join(valid_labels)}")
-    
-    files_data = db.get_all_files(label_filter=label_filter)
-    
-    files = []
-    for file_row in files_data:
-        files.append({
-            'fileId': file_row[0],
-            'filename': file_row[1],
-            'path': file_row[2],
-            'label': file_row[3],
-            'transient1Index': file_row[4],
-            'transient2Index': file_row[5],
-            'transient3Index': file_row[6],
-            'voltageLevel': file_row[7],
-            'currentLevel': file_row[8],
-            'binaryPath': file_row[9]
-        })
-    
-    return jsonify({
+    if label_filter and label_filter not in VALID_LABELS:
+        raise ValueError(VALID_LABELS_MSG)
+
+    after_id = request.args.get('after_id', type=int)
+    limit = request.args.get('limit', 500, type=int)
+    if limit <= 0 or limit > 5000:
+        raise ValueError("limit must be between 1 and 5000")
+
+    files_data = _cached_all_files(label_filter, after_id, limit)
+
+    files = [dict(zip(FILE_KEYS, file_row)) for file_row in files_data]
+
+    # Full page means there may be more rows - hand back the keyset cursor
+    next_after_id = files[-1]['fileId'] if len(files) == limit else None
+
+    return etag_json({
         'status': 'success',
         'files': files,
-        'count': len(files)
+        'count': len(files),
+        'nextAfterId': next_after_id
     })
 
+@files_api.route('/api/files.ndjson', methods=['GET'])
+def get_files_ndjson():
+    """Stream the file list as NDJSON, one file per line"""
+    label_filter = request.args.get('label')
+    if label_filter and label_filter not in VALID_LABELS:
+        raise ValueError(VALID_LABELS_MSG)
+
+    database = get_db()
+
+    def generate():
+        # Rows stream straight from the DB cursor - constant server memory
+        for row in database.iter_all_files(label_filter):
+            yield orjson.dumps(dict(zip(FILE_KEYS, tuple(row)))) + b'\n'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
 @files_api.route('/api/files/<int:file_id>', methods=['GET'])
-@handle_errors
 def get_file(file_id):
     """Get specific file by ID"""
     validate_file_id(file_id)
-    
-    file_data = db.get_file_by_id(file_id)
+
+    file_data = get_db().get_file_by_id(file_id)
     if not file_data:
         raise FileNotFoundError(f"File with ID {file_id} not found")
-    
-    file_info = {
-        'fileId': file_data[0],
-        'filename': file_data[1],
-        'path': file_data[2],
-        'label': file_data[3],
-        'transient1Index': file_data[4],
-        'transient2Index': file_data[5],
-        'transient3Index': file_data[6],
-        'voltageLevel': file_data[7],
-        'currentLevel': file_data[8],
-        'binaryPath': file_data[9],
-        'totalSamples': file_data[10] if len(file_data) > 10 else None,
-        'samplingRate': file_data[11] if len(file_data) > 11 else None
-    }
-    
-    return jsonify({
+
+    file_info = dict(zip(FILE_DETAIL_KEYS, file_data))
+    for key in FILE_DETAIL_KEYS[len(file_data):]:
+        file_info[key] = None
+
+    return fast_json({
         'status': 'success',
         'file': file_info
     })
 
+def decimate_min_max(data, max_points):
+    """Decimate signal data with vectorized bucket min/max (preserves peaks)"""
+    if max_points is None or len(data) <= max_points:
+        return data
+
+    buckets = max(max_points // 2, 1)
+    usable = (len(data) // buckets) * buckets
+    reshaped = data[:usable].reshape(buckets, -1)
+
+    # Interleave per-bucket min and max so transient spikes survive decimation
+    decimated = np.empty(buckets * 2, dtype=data.dtype)
+    decimated[0::2] = reshaped.min(axis=1)
+    decimated[1::2] = reshaped.max(axis=1)
+    return decimated
+
+def quantize_int16(data):
+    """Quantize signal data to int16, returning (quantized, scale)"""
+    scale = float(np.max(np.abs(data))) / 32767 if len(data) else 1.0
+    if scale == 0:
+        scale = 1.0
+    return np.round(data / scale).astype(np.int16), scale
+
+def parse_data_args():
+    """Parse max_points/dtype query args shared by the data endpoints"""
+    max_points = request.args.get('max_points', type=int)
+    if max_points is not None and max_points <= 0:
+        raise ValueError("max_points must be a positive integer")
+
+    dtype = request.args.get('dtype', 'float32')
+    if dtype not in ('int16', 'float32'):
+        raise ValueError("dtype must be 'int16' or 'float32'")
+
+    return max_points, dtype
+
 @files_api.route('/api/files/<int:file_id>/data', methods=['GET'])
 def get_file_data(file_id):
     """Get signal data for specific file"""
-    try:
-        load_voltage, source_current = db.load_file_data(file_id)
-        if load_voltage is None:
-            return jsonify({
-                'status': 'error',
-                'message': 'File data not found'
-            }), 404
-        
-        return jsonify({
-            'status': 'success',
-            'data': {
-                'loadVoltage': load_voltage.tolist() if load_voltage is not None else None,
-                'sourceCurrent': source_current.tolist() if source_current is not None else None
-            }
-        })
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    max_points, dtype = parse_data_args()
+
+    load_voltage, source_current = get_db().load_file_data(file_id)
+    if load_voltage is None:
+        return error_response(ERR_DATA_NOT_FOUND, 404)
+
+    load_voltage = decimate_min_max(load_voltage, max_points)
+    source_current = decimate_min_max(source_current, max_points)
+
+    voltage_scale = None
+    current_scale = None
+    if dtype == 'int16':
+        load_voltage, voltage_scale = quantize_int16(load_voltage)
+        source_current, current_scale = quantize_int16(source_current)
+
+    # orjson only serializes plain C-contiguous ndarrays - load_file_data
+    # can return memmaps or strided column views, so normalize both
+    # (no-op view when the array is already a contiguous ndarray)
+    load_voltage = np.ascontiguousarray(load_voltage)
+    source_current = np.ascontiguousarray(source_current)
+
+    # orjson serializes numpy arrays directly - no tolist() copy needed
+    return fast_json({
+        'status': 'success',
+        'data': {
+            'loadVoltage': load_voltage,
+            'sourceCurrent': source_current,
+            'dtype': dtype,
+            'sampleCount': len(load_voltage),
+            'loadVoltageScale': voltage_scale,
+            'sourceCurrentScale': current_scale
+        }
+    })
+
+@files_api.route('/api/files/<int:file_id>/data.bin', methods=['GET'])
+def get_file_data_binary(file_id):
+    """Get signal data as raw little-endian binary (no JSON encoding)"""
+    max_points, dtype = parse_data_args()
+
+    load_voltage, source_current = get_db().load_file_data(file_id)
+    if load_voltage is None:
+        return error_response(ERR_DATA_NOT_FOUND, 404)
+
+    load_voltage = decimate_min_max(load_voltage, max_points)
+    source_current = decimate_min_max(source_current, max_points)
+
+    if dtype == 'int16':
+        load_voltage, voltage_scale = quantize_int16(load_voltage)
+        source_current, current_scale = quantize_int16(source_current)
+        load_voltage = np.ascontiguousarray(load_voltage, dtype='<i2')
+        source_current = np.ascontiguousarray(source_current, dtype='<i2')
+    else:
+        load_voltage = np.ascontiguousarray(load_voltage, dtype='<f4')
+        source_current = np.ascontiguousarray(source_current, dtype='<f4')
+
+    def generate():
+        # Yield each channel's buffer directly - no concatenation copy
+        yield load_voltage.tobytes()
+        yield source_current.tobytes()
+
+    response = Response(generate(), mimetype='application/octet-stream',
+                        direct_passthrough=True)
+    response.headers['X-Sample-Count'] = str(len(load_voltage))
+    response.headers['X-Dtype'] = dtype
+    response.headers['X-Channels'] = 'load_voltage,source_current'
+    response.headers['Content-Length'] = str(load_voltage.nbytes + source_current.nbytes)
+    if dtype == 'int16':
+        response.headers['X-Load-Voltage-Scale'] = repr(voltage_scale)
+        response.headers['X-Source-Current-Scale'] = repr(current_scale)
+    return response
 
 @files_api.route('/api/files/<int:file_id>/label', methods=['PUT'])
 def update_file_label(file_id):
     """Update file label"""
-    try:
-        data = request.get_json()
-        if not data or 'label' not in data:
-            return jsonify({
-                'status': 'error',
-                'message': 'Missing label in request'
-            }), 400
-        
-        db.update_file_label(file_id, data['label'])
-        
-        return jsonify({
-            'status': 'success',
-            'message': f'Updated file {file_id} label to {data["label"]}'
-        })
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    data = request.get_json()
+    if not data or 'label' not in data:
+        return error_response(ERR_MISSING_LABEL, 400)
+
+    get_db().update_file_label(file_id, data['label'])
+    bump_cache_version()
+
+    return fast_json({
+        'status': 'success',
+        'message': f'Updated file {file_id} label to {data["label"]}'
+    })
 
 @files_api.route('/api/files/<int:file_id>/transients', methods=['PUT'])
 def update_transients(file_id):
     """Update transient indices"""
-    try:
-        data = request.get_json()
-        if not data:
-            return jsonify({
-                'status': 'error',
-                'message': 'Missing request data'
-            }), 400
-        
-        db.update_transient_indices(
-            file_id,
-            data.get('transient1'),
-            data.get('transient2'),
-            data.get('transient3')
-        )
-        
-        return jsonify({
-            'status': 'success',
-            'message': f'Updated transient indices for file {file_id}'
-        })
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    data = request.get_json()
+    if not data:
+        return error_response(ERR_MISSING_DATA, 400)
+
+    get_db().update_transient_indices(
+        file_id,
+        data.get('transient1'),
+        data.get('transient2'),
+        data.get('transient3')
+    )
+    bump_cache_version()
+
+    return fast_json({
+        'status': 'success',
+        'message': f'Updated transient indices for file {file_id}'
+    })
 
 @files_api.route('/api/status', methods=['GET'])
 def get_status_summary():
     """Get status summary"""
-    try:
-        summary = db.get_status_summary()
-        return jsonify({
-            'status': 'success',
-            'summary': summary
-        })
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    summary = _cached_status_summary()
+    return etag_json({
+        'status': 'success',
+        'summary': summary
+    })
 
 @files_api.route('/api/labels/statistics', methods=['GET'])
 def get_label_statistics():
     """Get label statistics"""
-    try:
-        stats = db.get_label_statistics()
-        return jsonify({
-            'status': 'success',
-            'statistics': [{'label': label, 'count': count} for label, count in stats]
-        })
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    stats = _cached_label_statistics()
+    return etag_json({
+        'status': 'success',
+        'statistics': [{'label': label, 'count': count} for label, count in stats]
+    })
 
 @files_api.route('/api/search', methods=['GET'])
 def search_files():
     """Search files by criteria"""
-    try:
-        filename = request.args.get('filename')
-        voltage_min = request.args.get('voltage_min', type=float)
-        voltage_max = request.args.get('voltage_max', type=float)
-        current_min = request.args.get('current_min', type=float)
-        current_max = request.args.get('current_max', type=float)
-        
-        voltage_range = None
-        if voltage_min is not None and voltage_max is not None:
-            voltage_range = (voltage_min, voltage_max)
-        
-        current_range = None
-        if current_min is not None and current_max is not None:
-            current_range = (current_min, current_max)
-        
-        results = db.search_files(filename, voltage_range, current_range)
-        
-        return jsonify({
-            'status': 'success',
-            'results': [{'file_id': r[0], 'filename': r[1], 'label': r[2], 
-                        'voltage': r[3], 'current': r[4]} for r in results]
-        })
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
\ No newline at end of file
+    filename = request.args.get('filename')
+    voltage_min = request.args.get('voltage_min', type=float)
+    voltage_max = request.args.get('voltage_max', type=float)
+    current_min = request.args.get('current_min', type=float)
+    current_max = request.args.get('current_max', type=float)
+
+    voltage_range = None
+    if voltage_min is not None and voltage_max is not None:
+        voltage_range = (voltage_min, voltage_max)
+
+    current_range = None
+    if current_min is not None and current_max is not None:
+        current_range = (current_min, current_max)
+
+    results = get_db().search_files(filename, voltage_range, current_range)
+
+    return fast_json({
+        'status': 'success',
+        'results': [{'file_id': r[0], 'filename': r[1], 'label': r[2],
+                    'voltage': r[3], 'current': r[4]} for r in results]
+    })
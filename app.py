@@ -6,58 +6,105 @@ Flask REST API for V3 arc detection database
 """
 
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
+import orjson
+import os
 import sqlite3
 import numpy as np
 import sys
 from pathlib import Path
 from api.files import files_api
+from database.operations import V3Database
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from flask_compress import Compress
 
 DATABASE_PATH = "/Volumes/ArcData/V3_database/arc_detection.db"
 BINARY_DATA_DIR = "/Volumes/ArcData/V3_database/fileset"
 
-app = Flask(__name__)
-
-# Configure rate limiting
-limiter = Limiter(
-    app,
-    key_func=get_remote_address,
-    default_limits=["1000 per hour", "100 per minute"]
-)
-
-# Register API blueprints
-app.register_blueprint(files_api)
-
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'service': 'database',
-        'version': '20250602_100100_0_0_1_1'
-    })
-
-@app.route('/', methods=['GET'])
-def index():
-    """Root endpoint"""
-    return jsonify({
-        'service': 'Database Service',
-        'version': '20250602_100100_0_0_1_1',
-        'endpoints': {
-            'files': '/api/files',
-            'file_data': '/api/files/{id}/data',
-            'file_details': '/api/files/{id}',
-            'update_label': '/api/files/{id}/label',
-            'update_transients': '/api/files/{id}/transients',
-            'search': '/api/search',
-            'statistics': '/api/labels/statistics',
-            'status': '/api/status',
-            'health': '/health'
-        }
-    })
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson for request parsing and jsonify"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+def create_app():
+    """Application factory - builds the Flask app and its database handle"""
+    app = Flask(__name__)
+    app.config['JSON_SORT_KEYS'] = False
+    app.json = OrjsonProvider(app)
+
+    # Transparent response compression - JSON payloads and file lists are
+    # highly compressible, so this trades a little CPU for large bandwidth
+    # wins. The ndjson and octet-stream endpoints are deliberately excluded:
+    # compressing them makes flask-compress buffer the whole streamed body
+    # in memory, defeating row-by-row streaming and data.bin passthrough.
+    app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+    app.config['COMPRESS_MIN_SIZE'] = 2048
+    app.config['COMPRESS_MIMETYPES'] = ['application/json']
+    Compress(app)
+
+    # Configure rate limiting. The default in-memory backend is per-process,
+    # which is both inaccurate and wasteful under multi-worker gunicorn -
+    # point RATELIMIT_STORAGE_URI at redis (redis://localhost:6379) so all
+    # workers share one moving-window bucket.
+    limiter = Limiter(
+        app,
+        key_func=get_remote_address,
+        default_limits=["1000 per hour", "100 per minute"],
+        storage_uri=os.getenv('RATELIMIT_STORAGE_URI', 'memory://'),
+        strategy='moving-window'
+    )
+
+    # Database handle is created once per app, not at module import, so the
+    # reloader and tests don't each leak a connection pool
+    app.extensions['database'] = V3Database()
+
+    # Register API blueprints
+    app.register_blueprint(files_api)
+
+    @app.route('/health', methods=['GET'])
+    @limiter.exempt
+    def health_check():
+        """Health check endpoint"""
+        return jsonify({
+            'status': 'healthy',
+            'service': 'database',
+            'version': '20250602_100100_0_0_1_1'
+        })
+
+    @app.route('/', methods=['GET'])
+    def index():
+        """Root endpoint"""
+        return jsonify({
+            'service': 'Database Service',
+            'version': '20250602_100100_0_0_1_1',
+            'endpoints': {
+                'files': '/api/files',
+                'files_stream': '/api/files.ndjson',
+                'file_data': '/api/files/{id}/data',
+                'file_data_binary': '/api/files/{id}/data.bin',
+                'file_details': '/api/files/{id}',
+                'update_label': '/api/files/{id}/label',
+                'update_transients': '/api/files/{id}/transients',
+                'search': '/api/search',
+                'statistics': '/api/labels/statistics',
+                'status': '/api/status',
+                'health': '/health'
+            }
+        })
+
+    return app
+
+# Module-level app for WSGI servers (gunicorn app:app) and direct runs
+app = create_app()
 
 if __name__ == "__main__":
-    print("Starting Database Service...")
+    # Development fallback only - production runs under gunicorn (see Procfile):
+    #   gunicorn -k gthread -w 4 --threads 8 -b 0.0.0.0:5001 app:app
+    print("Starting Database Service (development server)...")
     print("Available at: http://localhost:5001")
-    app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5001, threaded=True)
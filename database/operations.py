@@ -13,11 +13,26 @@ import time
 import threading
 from queue import Queue, Empty
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 # Configuration
 DATABASE_PATH = "/Volumes/ArcData/V3_database/arc_detection.db"
 BINARY_DATA_DIR = "/Volumes/ArcData/V3_database/fileset"
 
+# How many file_ids ahead of the current one to warm in the background
+PREFETCH_DEPTH = 4
+
+def default_pool_size():
+    """Reader pool size: V3DB_POOL_SIZE env var, else 2*cores + 1 capped at 32
+
+    SQLite serializes writes regardless of pool size, so readers beyond
+    ~2x the core count just burn memory without adding throughput.
+    """
+    env_size = os.getenv('V3DB_POOL_SIZE')
+    if env_size:
+        return max(1, int(env_size))
+    return min(32, (os.cpu_count() or 4) * 2 + 1)
+
 # Label types mapping
 LABEL_TYPES = {
     '1': 'arc',                              # Regular arc
@@ -44,54 +59,236 @@ ARC_AUGMENTATION_SCHEMES = {
     'other': ['unknown']
 }
 
+# SQL statements as module constants. Stable string identity means SQLite's
+# per-connection statement cache (see cached_statements below) keys on the
+# same text every call and always reuses the compiled plan.
+_SQL_FILE_LIST_BASE = '''
+    SELECT file_id, original_filename, original_path, selected_label,
+           transient1_index, transient2_index, transient3_index,
+           voltage_level, current_level, binary_data_path
+    FROM files WHERE 1=1
+'''
+
+_SQL_GET_FILE_BY_ID = '''
+    SELECT file_id, original_filename, original_path, selected_label,
+           transient1_index, transient2_index, transient3_index,
+           voltage_level, current_level, binary_data_path,
+           total_samples, sampling_rate, voltage_scale, current_scale,
+           binary_offset, binary_n_samples
+    FROM files WHERE file_id = ?
+'''
+
+_SQL_UPDATE_FILE_LABEL = '''
+    UPDATE files SET selected_label = ?, updated_at = CURRENT_TIMESTAMP
+    WHERE file_id = ?
+'''
+
+_SQL_UPDATE_TRANSIENTS = '''
+    UPDATE files SET
+        transient1_index = ?,
+        transient2_index = ?,
+        transient3_index = ?,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE file_id = ?
+'''
+
+_SQL_UPSERT_EXPERIMENT_STATUS = '''
+    INSERT INTO experiment_status
+    (file_id, status, manual_reviewed, reviewer_notes, reviewed_by, classification_confidence, reviewed_at)
+    VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(file_id) DO UPDATE SET
+        status = excluded.status,
+        manual_reviewed = excluded.manual_reviewed,
+        reviewer_notes = excluded.reviewer_notes,
+        reviewed_by = excluded.reviewed_by,
+        classification_confidence = excluded.classification_confidence,
+        reviewed_at = CURRENT_TIMESTAMP,
+        updated_at = CURRENT_TIMESTAMP
+'''
+
+_SQL_GET_EXPERIMENT_STATUS = '''
+    SELECT status, manual_reviewed, reviewer_notes, reviewed_by,
+           classification_confidence, reviewed_at, created_at, updated_at
+    FROM experiment_status WHERE file_id = ?
+'''
+
+_SQL_FILES_BY_STATUS_BASE = '''
+    SELECT f.file_id, f.original_filename, f.original_path, f.selected_label,
+           f.transient1_index, f.transient2_index, f.transient3_index,
+           f.voltage_level, f.current_level, f.binary_data_path,
+           es.status, es.manual_reviewed, es.reviewer_notes, es.reviewed_at
+    FROM files f
+    LEFT JOIN experiment_status es ON f.file_id = es.file_id
+    WHERE 1=1
+'''
+
+_SQL_STATUS_SUMMARY = '''
+    SELECT 'status' AS kind, status AS k, COUNT(*) AS count
+    FROM experiment_status GROUP BY status
+    UNION ALL
+    SELECT 'review', manual_reviewed, COUNT(*)
+    FROM experiment_status GROUP BY manual_reviewed
+    UNION ALL
+    SELECT 'recent', NULL, COUNT(*)
+    FROM experiment_status
+    WHERE reviewed_at >= datetime('now', '-24 hours')
+'''
+
+_SQL_GET_REJECTED_FILES = '''
+    SELECT r.rejection_id, r.file_id, r.filename, r.original_path,
+           r.original_label, r.rejected_at
+    FROM rejections r
+    ORDER BY r.rejected_at DESC
+'''
+
+_SQL_LABEL_STATISTICS = '''
+    SELECT selected_label, COUNT(*) as count
+    FROM files
+    GROUP BY selected_label
+    ORDER BY count DESC
+'''
+
+_SQL_SEARCH_BASE = "SELECT file_id, original_filename, selected_label, voltage_level, current_level FROM files WHERE 1=1"
+
 class DatabaseConnectionPool:
-    """Thread-safe SQLite connection pool for better performance"""
-    
-    def __init__(self, db_path, pool_size=10, timeout=30):
+    """Thread-safe SQLite pool: N pooled readers plus one dedicated writer
+
+    WAL mode supports many concurrent readers but only one writer at a
+    time, so all writes are funneled through a single lock-guarded
+    connection instead of competing for pooled readers.
+    """
+
+    def __init__(self, db_path, pool_size=None, timeout=30):
         self.db_path = db_path
+        if pool_size is None:
+            pool_size = default_pool_size()
         self.pool_size = pool_size
         self.timeout = timeout
-        self.pool = Queue(maxsize=pool_size)
+        # Split a ~1 GiB per-process page-cache budget across the pool
+        # (readers + writer). A fixed 1 GiB per connection would multiply
+        # out to tens of GiB across pool members and gunicorn workers.
+        self.cache_kib = max(16384, 1048576 // (pool_size + 1))
+        self.readers = Queue(maxsize=pool_size)
         self.lock = threading.Lock()
+        self.writer = None
+        self.writer_lock = threading.Lock()
         self._initialize_pool()
-    
+
     def _initialize_pool(self):
-        """Initialize the connection pool"""
+        """Initialize the reader pool and the dedicated writer connection"""
         for _ in range(self.pool_size):
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            conn.row_factory = sqlite3.Row  # Enable dict-like access
-            self.pool.put(conn)
+            conn = self._create_connection()
+            self.readers.put(conn)
+        self.writer = self._create_connection()
+        self._upgrade_schema()
+        print(f"Database connection pool ready: {self.pool_size} readers + 1 writer")
+
+    def _upgrade_schema(self):
+        """Add columns the service queries that older databases lack
+
+        The file-lookup SQL references the quantization and consolidated-
+        storage columns; without this, pointing the service at a database
+        created before them would fail every lookup with 'no such column'.
+        New columns stay NULL, which the load paths already treat as
+        'legacy layout'.
+        """
+        for column, col_type in (('voltage_scale', 'REAL'),
+                                 ('current_scale', 'REAL'),
+                                 ('binary_offset', 'INTEGER'),
+                                 ('binary_n_samples', 'INTEGER')):
+            try:
+                self.writer.execute(f'ALTER TABLE files ADD COLUMN {column} {col_type}')
+            except sqlite3.OperationalError:
+                pass  # Column already exists (or schema not created yet)
+
+    def _create_connection(self):
+        """Create a tuned SQLite connection for the pool
+
+        Note: WAL requires DATABASE_PATH to live on a local filesystem -
+        the shared-memory index is unsafe over AFP/NFS mounts.
+        """
+        # cached_statements keeps compiled statements alive across calls so
+        # repeated queries skip the SQL parse/plan step. Autocommit mode
+        # (isolation_level=None) lets write methods issue explicit
+        # BEGIN IMMEDIATE to take the write lock up front instead of
+        # failing with SQLITE_BUSY at upgrade time.
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               cached_statements=256, isolation_level=None)
+        conn.row_factory = sqlite3.Row  # Enable dict-like access
+        # WAL lets pooled readers run concurrently with a writer; mmap and a
+        # larger page cache turn hot-page reads into memory hits. The cache
+        # is each connection's share of the per-process budget (see __init__).
+        conn.executescript(f'''
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA cache_size=-{self.cache_kib};
+            PRAGMA temp_store=MEMORY;
+            PRAGMA mmap_size=268435456;
+            PRAGMA foreign_keys=ON;
+            PRAGMA busy_timeout=30000;
+        ''')
+        return conn
     
     @contextmanager
-    def get_connection(self):
-        """Get a connection from the pool"""
+    def get_read_connection(self):
+        """Get a reader connection from the pool"""
         conn = None
         try:
-            conn = self.pool.get(timeout=self.timeout)
+            conn = self.readers.get(timeout=self.timeout)
             yield conn
         except Empty:
             raise Exception("Database connection pool exhausted")
         finally:
             if conn:
-                self.pool.put(conn)
-    
+                self.readers.put(conn)
+
+    @contextmanager
+    def get_write_connection(self):
+        """Get the dedicated writer connection, wrapped in BEGIN IMMEDIATE
+
+        Commits on success and rolls back on error; callers just execute
+        their statements.
+        """
+        with self.writer_lock:
+            self.writer.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.writer
+                self.writer.execute('COMMIT')
+            except Exception:
+                self.writer.execute('ROLLBACK')
+                raise
+
+    # Read access under the original name, for existing callers
+    get_connection = get_read_connection
+
     def close_all(self):
         """Close all connections in the pool"""
-        while not self.pool.empty():
+        while not self.readers.empty():
             try:
-                conn = self.pool.get_nowait()
+                conn = self.readers.get_nowait()
                 conn.close()
             except Empty:
                 break
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
 
 # Global connection pool instance
 _connection_pool = None
+_pool_lock = threading.Lock()
 
 def get_connection_pool():
-    """Get or create the global connection pool"""
+    """Get or create the global connection pool
+
+    Double-checked locking: the unlocked fast path covers every call after
+    the first, while the lock stops two threads racing the first call from
+    each building (and leaking) a full pool of connections.
+    """
     global _connection_pool
     if _connection_pool is None:
-        _connection_pool = DatabaseConnectionPool(DATABASE_PATH)
+        with _pool_lock:
+            if _connection_pool is None:
+                _connection_pool = DatabaseConnectionPool(DATABASE_PATH)
     return _connection_pool
 
 class V3Database:
@@ -101,66 +298,244 @@ class V3Database:
         self.db_path = db_path
         self.binary_dir = BINARY_DATA_DIR
         self.pool = get_connection_pool()
+        # File rows rarely change, so lookups are memoized per file_id;
+        # writes evict only the touched id instead of flushing everything.
+        # Entries also expire after a short TTL: under multi-worker gunicorn
+        # a write handled by one worker can't evict its siblings' caches,
+        # so the TTL bounds how stale a cross-worker read can ever be.
+        self._file_cache = {}
+        self._file_cache_lock = threading.Lock()
+        self._file_cache_max = 4096
+        self._file_cache_ttl = 5.0
+        # Two background threads warm the page cache for upcoming files while
+        # the caller is still working on the current one
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=2,
+                                                     thread_name_prefix='prefetch')
     
+    def get_read_connection(self):
+        """Get a reader connection from the pool"""
+        return self.pool.get_read_connection()
+
+    def get_write_connection(self):
+        """Get the dedicated writer connection (transactional)"""
+        return self.pool.get_write_connection()
+
     def get_connection(self):
-        """Get database connection from pool"""
-        return self.pool.get_connection()
+        """Alias for get_read_connection, kept for existing callers
+
+        Always use it as a context manager (``with db.get_connection() as
+        conn:``) - the connection goes back to the pool on exit, so never
+        call ``conn.close()`` on it.
+        """
+        return self.pool.get_read_connection()
     
-    def get_all_files(self, label_filter=None):
-        """Get all files, optionally filtered by label"""
-        with self.get_connection() as conn:
+    def get_all_files(self, label_filter=None, after_id=None, limit=None):
+        """Get files ordered by file_id, optionally filtered by label
+
+        Pagination is keyset-based: pass after_id from the previous page's
+        last row instead of OFFSET, so page cost stays O(page size).
+        """
+        with self.get_read_connection() as conn:
             cursor = conn.cursor()
-            
+
+            query = _SQL_FILE_LIST_BASE
+            params = []
+
             if label_filter:
-                cursor.execute('''
-                    SELECT file_id, original_filename, original_path, selected_label,
-                           transient1_index, transient2_index, transient3_index,
-                           voltage_level, current_level, binary_data_path
-                    FROM files WHERE selected_label = ? ORDER BY file_id
-                ''', (label_filter,))
-            else:
-                cursor.execute('''
-                    SELECT file_id, original_filename, original_path, selected_label,
-                           transient1_index, transient2_index, transient3_index,
-                           voltage_level, current_level, binary_data_path
-                    FROM files ORDER BY file_id
-                ''')
-            
+                query += ' AND selected_label = ?'
+                params.append(label_filter)
+
+            if after_id is not None:
+                query += ' AND file_id > ?'
+                params.append(after_id)
+
+            query += ' ORDER BY file_id'
+
+            if limit is not None:
+                query += ' LIMIT ?'
+                params.append(limit)
+
+            cursor.execute(query, params)
             return cursor.fetchall()
-    
+
+    def iter_all_files(self, label_filter=None):
+        """Iterate files row-by-row without materializing the full result set
+
+        Holds a pooled connection for the duration of iteration, so consume
+        the generator promptly (e.g. while streaming a response).
+        """
+        with self.get_read_connection() as conn:
+            query = _SQL_FILE_LIST_BASE
+            params = []
+
+            if label_filter:
+                query += ' AND selected_label = ?'
+                params.append(label_filter)
+
+            query += ' ORDER BY file_id'
+
+            for row in conn.execute(query, params):
+                yield row
+
     def get_file_by_id(self, file_id):
-        """Get file information by file_id"""
-        with self.get_connection() as conn:
+        """Get file information by file_id (memoized briefly, see __init__)"""
+        now = time.time()
+        with self._file_cache_lock:
+            entry = self._file_cache.get(file_id)
+            if entry is not None and now - entry[1] < self._file_cache_ttl:
+                return entry[0]
+
+        row = self._fetch_file_by_id(file_id)
+
+        with self._file_cache_lock:
+            if len(self._file_cache) >= self._file_cache_max:
+                # Evict the oldest insertion (dicts preserve insertion order)
+                self._file_cache.pop(next(iter(self._file_cache)))
+            self._file_cache[file_id] = (row, now)
+        return row
+
+    def _evict_file_cache(self, file_id):
+        """Drop one file's memoized row after a write touches it"""
+        with self._file_cache_lock:
+            self._file_cache.pop(file_id, None)
+
+    def _fetch_file_by_id(self, file_id):
+        """Uncached file lookup straight from SQLite"""
+        with self.get_read_connection() as conn:
             cursor = conn.cursor()
             
-            cursor.execute('''
-                SELECT file_id, original_filename, original_path, selected_label,
-                       transient1_index, transient2_index, transient3_index,
-                       voltage_level, current_level, binary_data_path,
-                       total_samples, sampling_rate
-                FROM files WHERE file_id = ?
-            ''', (file_id,))
-            
+            cursor.execute(_SQL_GET_FILE_BY_ID, (file_id,))
+
             return cursor.fetchone()
     
+    def _binary_paths(self, binary_name):
+        """Resolve the on-disk file(s) backing a binary_data_path entry"""
+        if binary_name.endswith('.npy'):
+            return [os.path.join(self.binary_dir, binary_name)]
+        return [os.path.join(self.binary_dir, f"{binary_name}_v.npy"),
+                os.path.join(self.binary_dir, f"{binary_name}_i.npy")]
+
+    @staticmethod
+    def _advise_willneed(path, offset=0, length=0):
+        """Ask the kernel to start reading a file region ahead of use"""
+        if not hasattr(os, 'posix_fadvise'):
+            return
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+    def _prefetch_file(self, file_id):
+        """Warm the OS page cache for one file's binary data
+
+        Runs on a background thread; best-effort only, errors are swallowed
+        so prefetching can never break the foreground request.
+        """
+        try:
+            file_info = self.get_file_by_id(file_id)
+            if not file_info:
+                return
+            binary_name = file_info[9]
+
+            # Consolidated layout: advise only this file's byte range
+            if binary_name.endswith('.dat'):
+                path = os.path.join(self.binary_dir, binary_name)
+                offset, n_samples = file_info[14], file_info[15]
+                if offset is None or not n_samples or not os.path.exists(path):
+                    return
+                self._advise_willneed(path, offset, 4 * n_samples)
+                np.memmap(path, dtype=np.int16, mode='r',
+                          offset=offset, shape=(1,))[0]
+                return
+
+            for path in self._binary_paths(binary_name):
+                if not os.path.exists(path):
+                    continue
+                self._advise_willneed(path)
+                # Touch the first element so the mmap faults its first page in
+                data = np.load(path, mmap_mode='r')
+                if data.size:
+                    data.flat[0]
+        except Exception:
+            pass
+
     def load_file_data(self, file_id):
         """Load load voltage and source current data for a file"""
         file_info = self.get_file_by_id(file_id)
         if not file_info:
             return None, None
-        
-        binary_filename = file_info[9]  # binary_data_path
-        binary_path = os.path.join(self.binary_dir, binary_filename)
-        
-        if not os.path.exists(binary_path):
-            print(f"Binary file not found: {binary_path}")
+
+        # Labelling walks file_ids sequentially - start paging the next few
+        # files in while the caller renders this one, so "next" is warm
+        for neighbour in range(file_id + 1, file_id + 1 + PREFETCH_DEPTH):
+            self._prefetch_executor.submit(self._prefetch_file, neighbour)
+
+        binary_name = file_info[9]  # binary_data_path
+
+        # Consolidated layout: both channels live as contiguous int16 blocks
+        # (voltage first, then current) at binary_offset inside one big
+        # append-only file - no per-file open or .npy header parse
+        if binary_name.endswith('.dat'):
+            binary_path = os.path.join(self.binary_dir, binary_name)
+            offset = file_info[14]      # binary_offset
+            n_samples = file_info[15]   # binary_n_samples
+
+            if offset is None or not n_samples or not os.path.exists(binary_path):
+                print(f"Consolidated data not found for file {file_id}")
+                return None, None
+
+            try:
+                voltage = np.memmap(binary_path, dtype=np.int16, mode='r',
+                                    offset=offset, shape=(n_samples,))
+                current = np.memmap(binary_path, dtype=np.int16, mode='r',
+                                    offset=offset + 2 * n_samples, shape=(n_samples,))
+                voltage_scale = file_info[12] or 1.0  # voltage_scale
+                current_scale = file_info[13] or 1.0  # current_scale
+                return (voltage.astype(np.float32) * voltage_scale,
+                        current.astype(np.float32) * current_scale)
+            except Exception as e:
+                print(f"Error loading binary data: {e}")
+                return None, None
+
+        # Legacy layout: one interleaved [samples, 2] .npy file
+        if binary_name.endswith('.npy'):
+            binary_path = os.path.join(self.binary_dir, binary_name)
+
+            if not os.path.exists(binary_path):
+                print(f"Binary file not found: {binary_path}")
+                return None, None
+
+            try:
+                # Memory-map so pages fault in on demand and stay shared in
+                # the OS page cache
+                data = np.load(binary_path, mmap_mode='r')
+                return data[:, 0], data[:, 1]  # zero-copy strided views
+            except Exception as e:
+                print(f"Error loading binary data: {e}")
+                return None, None
+
+        # Column-separated (SoA) layout: contiguous per-channel files under a
+        # shared stem, so reading one channel costs half the interleaved bytes
+        voltage_path = os.path.join(self.binary_dir, f"{binary_name}_v.npy")
+        current_path = os.path.join(self.binary_dir, f"{binary_name}_i.npy")
+
+        if not (os.path.exists(voltage_path) and os.path.exists(current_path)):
+            print(f"Binary files not found for stem: {binary_name}")
             return None, None
-        
+
         try:
-            # Load NumPy array [samples, 2] - [load_voltage, source_current]
-            data = np.load(binary_path)
-            load_voltage_data = data[:, 0]
-            source_current_data = data[:, 1]
+            load_voltage_data = np.load(voltage_path, mmap_mode='r')
+            source_current_data = np.load(current_path, mmap_mode='r')
+
+            # Quantized channels carry a per-channel scale in the files table;
+            # reconstruct physical units as float32
+            if load_voltage_data.dtype == np.int16:
+                voltage_scale = file_info[12] or 1.0  # voltage_scale
+                current_scale = file_info[13] or 1.0  # current_scale
+                load_voltage_data = load_voltage_data.astype(np.float32) * voltage_scale
+                source_current_data = source_current_data.astype(np.float32) * current_scale
+
             return load_voltage_data, source_current_data
         except Exception as e:
             print(f"Error loading binary data: {e}")
@@ -168,160 +543,103 @@ class V3Database:
     
     def update_file_label(self, file_id, new_label):
         """Update file label"""
-        with self.get_connection() as conn:
+        with self.get_write_connection() as conn:
             cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE files SET selected_label = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE file_id = ?
-            ''', (new_label, file_id))
-            
-            conn.commit()
-            print(f"Updated file {file_id} label to: {new_label}")
+
+            cursor.execute(_SQL_UPDATE_FILE_LABEL, (new_label, file_id))
+
+        self._evict_file_cache(file_id)
+        print(f"Updated file {file_id} label to: {new_label}")
     
     def update_transient_indices(self, file_id, transient1=None, transient2=None, transient3=None):
         """Update transient indices for a file"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE files SET 
-                transient1_index = ?, 
-                transient2_index = ?, 
-                transient3_index = ?,
-                updated_at = CURRENT_TIMESTAMP
-            WHERE file_id = ?
-        ''', (transient1, transient2, transient3, file_id))
-        
-        conn.commit()
-        conn.close()
+        with self.get_write_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(_SQL_UPDATE_TRANSIENTS,
+                           (transient1, transient2, transient3, file_id))
+
+        self._evict_file_cache(file_id)
         print(f"Updated file {file_id} transient indices: {transient1}, {transient2}, {transient3}")
     
     def update_experiment_status(self, file_id, status, manual_reviewed=True, reviewer_notes=None, reviewer_name=None, confidence=None):
         """Update experiment status in the new status table"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            # Check if status record exists
-            cursor.execute('SELECT file_id FROM experiment_status WHERE file_id = ?', (file_id,))
-            exists = cursor.fetchone()
-            
-            if exists:
-                # Update existing record
-                cursor.execute('''
-                    UPDATE experiment_status SET 
-                        status = ?, 
-                        manual_reviewed = ?, 
-                        reviewer_notes = ?,
-                        reviewed_by = ?,
-                        classification_confidence = ?,
-                        reviewed_at = CURRENT_TIMESTAMP,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE file_id = ?
-                ''', (status, 1 if manual_reviewed else 0, reviewer_notes, reviewer_name, confidence, file_id))
-            else:
-                # Insert new record
-                cursor.execute('''
-                    INSERT INTO experiment_status 
-                    (file_id, status, manual_reviewed, reviewer_notes, reviewed_by, classification_confidence, reviewed_at)
-                    VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                ''', (file_id, status, 1 if manual_reviewed else 0, reviewer_notes, reviewer_name, confidence))
-            
-            conn.commit()
+            with self.get_write_connection() as conn:
+                cursor = conn.cursor()
+
+                # Single UPSERT instead of SELECT-then-UPDATE/INSERT: one
+                # statement, no exists round-trip, and no lost-update window.
+                # file_id is the table's primary key, which anchors the
+                # ON CONFLICT clause.
+                cursor.execute(_SQL_UPSERT_EXPERIMENT_STATUS,
+                               (file_id, status, 1 if manual_reviewed else 0,
+                                reviewer_notes, reviewer_name, confidence))
+
             print(f"Updated experiment {file_id} status to: {status}")
             return True
-            
+
         except Exception as e:
             print(f"Error updating experiment status: {e}")
-            conn.rollback()
             return False
-        finally:
-            conn.close()
     
     def get_experiment_status(self, file_id):
         """Get experiment status information"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT status, manual_reviewed, reviewer_notes, reviewed_by, 
-                   classification_confidence, reviewed_at, created_at, updated_at
-            FROM experiment_status WHERE file_id = ?
-        ''', (file_id,))
-        
-        result = cursor.fetchone()
-        conn.close()
-        return result
+        with self.get_read_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(_SQL_GET_EXPERIMENT_STATUS, (file_id,))
+
+            return cursor.fetchone()
     
     def get_files_by_status(self, status=None, manual_reviewed=None):
         """Get files filtered by status and/or manual review flag"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        query = '''
-            SELECT f.file_id, f.original_filename, f.original_path, f.selected_label,
-                   f.transient1_index, f.transient2_index, f.transient3_index,
-                   f.voltage_level, f.current_level, f.binary_data_path,
-                   es.status, es.manual_reviewed, es.reviewer_notes, es.reviewed_at
-            FROM files f
-            LEFT JOIN experiment_status es ON f.file_id = es.file_id
-            WHERE 1=1
-        '''
-        params = []
-        
-        if status is not None:
-            query += ' AND es.status = ?'
-            params.append(status)
-        
-        if manual_reviewed is not None:
-            query += ' AND es.manual_reviewed = ?'
-            params.append(1 if manual_reviewed else 0)
-        
-        query += ' ORDER BY f.file_id'
-        
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-        conn.close()
-        return results
+        with self.get_read_connection() as conn:
+            cursor = conn.cursor()
+
+            query = _SQL_FILES_BY_STATUS_BASE
+            params = []
+
+            if status is not None:
+                query += ' AND es.status = ?'
+                params.append(status)
+
+            if manual_reviewed is not None:
+                query += ' AND es.manual_reviewed = ?'
+                params.append(1 if manual_reviewed else 0)
+
+            query += ' ORDER BY f.file_id'
+
+            cursor.execute(query, params)
+            return cursor.fetchall()
     
     def get_status_summary(self):
         """Get summary statistics for experiment status"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Status counts
-        cursor.execute('''
-            SELECT status, COUNT(*) as count 
-            FROM experiment_status 
-            GROUP BY status 
-            ORDER BY count DESC
-        ''')
-        status_counts = cursor.fetchall()
-        
-        # Manual review counts
-        cursor.execute('''
-            SELECT manual_reviewed, COUNT(*) as count 
-            FROM experiment_status 
-            GROUP BY manual_reviewed
-        ''')
-        review_counts = cursor.fetchall()
-        
-        # Recent activity
-        cursor.execute('''
-            SELECT COUNT(*) as recent_reviews
-            FROM experiment_status 
-            WHERE reviewed_at >= datetime('now', '-24 hours')
-        ''')
-        recent_reviews = cursor.fetchone()[0]
-        
-        conn.close()
-        
-        return {
-            'status_counts': status_counts,
-            'review_counts': review_counts,
-            'recent_reviews': recent_reviews
-        }
+        with self.get_read_connection() as conn:
+            cursor = conn.cursor()
+
+            # One scan of experiment_status instead of three separate
+            # aggregation queries; rows are tagged by kind and split in Python
+            cursor.execute(_SQL_STATUS_SUMMARY)
+
+            status_counts = []
+            review_counts = []
+            recent_reviews = 0
+            for kind, key, count in cursor.fetchall():
+                if kind == 'status':
+                    status_counts.append((key, count))
+                elif kind == 'review':
+                    review_counts.append((key, count))
+                else:
+                    recent_reviews = count
+
+            status_counts.sort(key=lambda item: item[1], reverse=True)
+
+            return {
+                'status_counts': status_counts,
+                'review_counts': review_counts,
+                'recent_reviews': recent_reviews
+            }
 
     def add_rejection(self, file_id):
         """Legacy method - now uses status table"""
@@ -330,19 +648,12 @@ class V3Database:
     
     def get_rejected_files(self):
         """Get all rejected files"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT r.rejection_id, r.file_id, r.filename, r.original_path, 
-                   r.original_label, r.rejected_at
-            FROM rejections r
-            ORDER BY r.rejected_at DESC
-        ''')
-        
-        rejections = cursor.fetchall()
-        conn.close()
-        return rejections
+        with self.get_read_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(_SQL_GET_REJECTED_FILES)
+
+            return cursor.fetchall()
     
     def get_augmentation_scheme(self, label):
         """Get augmentation scheme for a label type"""
@@ -350,46 +661,53 @@ class V3Database:
     
     def get_label_statistics(self):
         """Get statistics about labels in database"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT selected_label, COUNT(*) as count
-            FROM files 
-            GROUP BY selected_label 
-            ORDER BY count DESC
-        ''')
-        
-        stats = cursor.fetchall()
-        conn.close()
-        return stats
+        with self.get_read_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(_SQL_LABEL_STATISTICS)
+
+            return cursor.fetchall()
     
     def search_files(self, filename_pattern=None, voltage_range=None, current_range=None):
-        """Search files by various criteria"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        query = "SELECT file_id, original_filename, selected_label, voltage_level, current_level FROM files WHERE 1=1"
-        params = []
-        
-        if filename_pattern:
-            query += " AND original_filename LIKE ?"
-            params.append(f"%{filename_pattern}%")
-        
-        if voltage_range:
-            query += " AND voltage_level BETWEEN ? AND ?"
-            params.extend(voltage_range)
-        
-        if current_range:
-            query += " AND current_level BETWEEN ? AND ?"
-            params.extend(current_range)
-        
-        query += " ORDER BY file_id"
-        
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-        conn.close()
-        return results
+        """Search files by various criteria
+
+        Ranges are half-open [min, max) so consecutive range queries tile
+        without overlap and SQLite can use the composite range index.
+        """
+        with self.get_read_connection() as conn:
+            cursor = conn.cursor()
+
+            base = _SQL_SEARCH_BASE
+            filters = ""
+            params = []
+
+            if voltage_range:
+                filters += " AND voltage_level >= ? AND voltage_level < ?"
+                params.extend(voltage_range)
+
+            if current_range:
+                filters += " AND current_level >= ? AND current_level < ?"
+                params.extend(current_range)
+
+            order = " ORDER BY file_id"
+
+            if filename_pattern:
+                # Filename search goes through the FTS5 index - LIKE '%x%'
+                # forces a full table scan, MATCH is an index lookup
+                fts_query = (base +
+                             " AND file_id IN (SELECT rowid FROM files_fts WHERE files_fts MATCH ?)" +
+                             filters + order)
+                try:
+                    cursor.execute(fts_query, [f'"{filename_pattern}"*'] + params)
+                    return cursor.fetchall()
+                except sqlite3.OperationalError:
+                    # Databases created before the FTS table fall back to LIKE
+                    like_query = base + " AND original_filename LIKE ?" + filters + order
+                    cursor.execute(like_query, [f"%{filename_pattern}%"] + params)
+                    return cursor.fetchall()
+
+            cursor.execute(base + filters + order, params)
+            return cursor.fetchall()
 
 # Convenience functions
 def get_database():